@@ -0,0 +1,66 @@
+import re
+
+from images import estimate_text_tokens
+
+GRAMMAR_PROMPT = (
+    "Please review the following text and improve its grammar, punctuation, and clarity "
+    "without changing its tone or meaning. Only return the corrected version, without explanation.\n\n"
+)
+
+BATCH_PROMPT = (
+    "Please review each of the following paragraphs and improve its grammar, punctuation, and clarity "
+    "without changing its tone or meaning. Each paragraph is wrapped in <p id=\"N\"></p> tags. "
+    "Return every corrected paragraph wrapped in the same tags with the same id, in the same order, "
+    "without explanation.\n\n"
+)
+
+_TAGGED = re.compile(r'<p id="(\d+)">(.*?)</p>', re.S)
+
+
+def packable(text):
+    # Text that already contains our tags can't be split back reliably; it goes on its own
+    return "<p id=" not in text and "</p>" not in text
+
+
+def pack(texts, budget, max_items):
+    """Group indices of ``texts`` into batches of at most ``budget`` estimated tokens, keeping order."""
+    batches = []
+    current = []
+    used = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_text_tokens(text)
+        if not packable(text):
+            if current:
+                batches.append(current)
+                current = []
+                used = 0
+            batches.append([i])
+            continue
+        if current and (used + tokens > budget or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(i)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def batch_prompt(texts):
+    tagged = "\n\n".join(f'<p id="{i}">{text}</p>' for i, text in enumerate(texts))
+    return BATCH_PROMPT + tagged
+
+
+def split_batch(output, count):
+    """Map the model's tagged answer back to ``count`` results; None where an id is missing or repeated."""
+    results = [None] * count
+    seen = set()
+    for index, text in _TAGGED.findall(output):
+        index = int(index)
+        if index >= count:
+            continue
+        # Two answers for one paragraph: can't tell which is right, so it gets retried alone
+        results[index] = None if index in seen else text.strip()
+        seen.add(index)
+    return results
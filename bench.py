@@ -0,0 +1,284 @@
+"""Replay a JSONL corpus of recorded requests against main.app with Bedrock and S3 stubbed out.
+
+Each corpus line is one request:
+
+    {"endpoint": "/grammar-check", "json": {"text": "..."}}
+    {"endpoint": "/generate-summary", "json": {"image_keys": ["uploads/a.jpg"], "prompt": "..."}}
+    {"endpoint": "/generate-narrative", "form": {"prompt": "..."}, "image": {"width": 4032, "height": 3024}}
+    {"endpoint": "/get-image-url", "method": "GET", "params": {"key": "uploads/a.jpg"}}
+
+"image" may also be {"path": "photo.jpg"}; "headers" and "params" are passed
+through. Requests are sent closed-loop by --concurrency workers, or
+open-loop at --rate requests/second (Poisson arrivals). Several
+--concurrency levels sweep throughput against concurrency, all in one
+event loop. Every level (and every single run) starts from fresh caches
+and router state, and the fakes are installed with --target-rpm/--target-tpm
+limits high enough that the gateway's own token buckets stay out of the way.
+
+    python bench.py bench_corpus.jsonl --concurrency 16 --save bench_baseline.json
+    python bench.py bench_corpus.jsonl --concurrency 16 --compare bench_baseline.json
+    python bench.py bench_corpus.jsonl --requests 256 --concurrency 1 8 32 64 --bypass-cache
+    python bench.py bench_corpus.jsonl --endpoint /grammar-check --concurrency 1 8 32 64 --bypass-cache
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+
+import httpx
+
+import main
+from fakes import FakeBedrock, FakeS3, fake_jpeg
+from image_cache import image_cache_from_env
+from images import prepare_image
+from presign import url_cache_from_env
+from response_cache import MemoryStore, ResponseCache
+from router import TokenBucket, router_from_env
+from sessions import sessions_from_env
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def image_bytes(spec):
+    if "path" in spec:
+        with open(spec["path"], "rb") as f:
+            return f.read()
+    return fake_jpeg(spec["width"], spec["height"])
+
+
+def build_request(client, entry, bypass_cache):
+    headers = dict(entry.get("headers", {}))
+    if bypass_cache:
+        headers["X-Cache-Bypass"] = "1"
+    kwargs = {"params": entry.get("params"), "headers": headers}
+    if "json" in entry:
+        kwargs["json"] = entry["json"]
+    if "form" in entry:
+        kwargs["data"] = entry["form"]
+    if "image" in entry:
+        kwargs["files"] = {"image": ("image.jpg", image_bytes(entry["image"]), "image/jpeg")}
+    return client.build_request(entry.get("method", "POST"), entry["endpoint"], **kwargs)
+
+
+def install_fakes(bedrock, s3, rpm, tpm):
+    """Point main at the fakes with cold caches and fresh router targets limited to ``rpm``/``tpm``."""
+    router = router_from_env(main.DEFAULT_ROUTES, main.bedrock_backend, lambda region: bedrock)
+    for target in {target for targets in router.routes.values() for target in targets}:
+        target.requests = TokenBucket(rpm)
+        target.tokens = TokenBucket(tpm)
+    main.router = router
+    main.s3 = s3
+    # Memory only: a persistent store would carry answers over from earlier runs
+    main.response_cache = ResponseCache(MemoryStore(main.response_cache.memory.max_bytes), ttl=main.response_cache.ttl)
+    main.image_cache = image_cache_from_env(s3, transform=prepare_image)
+    main.url_cache = url_cache_from_env(s3, main.BUCKET_NAME)
+    main.sessions = sessions_from_env()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def sample_loop_lag(samples, interval=0.01):
+    # How late the loop wakes us up: anything blocking a handler shows up here
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def replay(corpus, total, concurrency, rate, bypass_cache):
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = {}  # successful responses only, so fast rejections can't pass for a speed-up
+    errors = {}
+    statuses = {}
+    lag = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway", timeout=None) as client:
+        async def send(entry):
+            request = build_request(client, entry, bypass_cache)
+            start = time.perf_counter()
+            response = await client.send(request)
+            elapsed = time.perf_counter() - start
+            if response.is_success:
+                latencies.setdefault(entry["endpoint"], []).append(elapsed)
+            else:
+                errors[entry["endpoint"]] = errors.get(entry["endpoint"], 0) + 1
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        entries = [corpus[i % len(corpus)] for i in range(total)]
+        sampler = asyncio.create_task(sample_loop_lag(lag))
+        start = time.perf_counter()
+
+        if rate:
+            tasks = []
+            for entry in entries:
+                tasks.append(asyncio.create_task(send(entry)))
+                await asyncio.sleep(random.expovariate(rate))
+            await asyncio.gather(*tasks)
+        else:
+            queue = iter(entries)
+
+            async def worker():
+                for entry in queue:
+                    await send(entry)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+
+    everything = [t for values in latencies.values() for t in values]
+    endpoints = {}
+    for endpoint in sorted(set(latencies) | set(errors)):
+        endpoints[endpoint] = summarize(latencies.get(endpoint, []))
+        endpoints[endpoint]["errors"] = errors.get(endpoint, 0)
+    return {
+        "concurrency": None if rate else concurrency,
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        # Successful responses per second
+        "throughput_rps": round(len(everything) / elapsed, 2),
+        "error_rate": round(sum(errors.values()) / total, 4),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "latency": summarize(everything),
+        "endpoints": endpoints,
+        "loop_lag_ms": {
+            "p99": round(percentile(lag, 99) * 1000, 2),
+            "max": round(max(lag, default=0) * 1000, 2),
+        },
+    }
+
+
+async def sweep(corpus, total, levels, rate, bypass_cache, setup):
+    results = []
+    for concurrency in levels:
+        setup()
+        results.append(await replay(corpus, total, concurrency, rate, bypass_cache))
+    return results
+
+
+def compare(result, baseline, tolerance, error_tolerance):
+    """List regressions against a saved baseline.
+
+    Latency and throughput may worsen by ``tolerance`` (a fraction); the
+    share of non-2xx responses may rise by ``error_tolerance`` (absolute).
+    """
+    regressions = []
+
+    def check(name, current, before, higher_is_worse=True):
+        if not before:
+            return
+        change = (current - before) / before
+        if (change if higher_is_worse else -change) > tolerance:
+            regressions.append(f"{name}: {before} -> {current} ({change:+.0%})")
+
+    before_levels = {level["concurrency"]: level for level in baseline.get("levels", [baseline])}
+    for level in result.get("levels", [result]):
+        before_level = before_levels.get(level["concurrency"])
+        if before_level is None:
+            continue
+        prefix = f"c={level['concurrency']} " if "levels" in result else ""
+        check(f"{prefix}throughput_rps", level["throughput_rps"], before_level["throughput_rps"], higher_is_worse=False)
+        error_rate, error_rate_before = level["error_rate"], before_level.get("error_rate", 0.0)
+        if error_rate - error_rate_before > error_tolerance:
+            regressions.append(f"{prefix}error_rate: {error_rate_before} -> {error_rate}")
+        for endpoint, stats in level["endpoints"].items():
+            before = before_level["endpoints"].get(endpoint)
+            if before and stats["count"]:
+                for key in ("p50_ms", "p95_ms", "p99_ms"):
+                    check(f"{prefix}{endpoint} {key}", stats[key], before[key])
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline replay benchmark for the gateway")
+    parser.add_argument("corpus", help="JSONL file of recorded requests")
+    parser.add_argument("--requests", type=int, help="total requests to send (default: one pass over the corpus)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8], help="closed-loop workers; several values run a sweep")
+    parser.add_argument("--endpoint", action="append", help="only replay corpus entries for this endpoint (repeatable)")
+    parser.add_argument("--rate", type=float, help="open-loop arrival rate in requests/second")
+    parser.add_argument("--bedrock-latency", default="lognormal:0.8:0.4", help="seconds, or uniform:a:b / lognormal:median:sigma")
+    parser.add_argument("--output-tokens", default="uniform:50:400", help="fake answer length distribution")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of Bedrock calls that throttle")
+    parser.add_argument("--s3-latency", default="uniform:0.02:0.08")
+    parser.add_argument("--s3-image-sizes", default="1568x1176,4032x3024", help="comma-separated WxH of stored photos")
+    parser.add_argument("--bypass-cache", action="store_true", help="send X-Cache-Bypass on every request")
+    parser.add_argument("--target-rpm", type=int, default=1_000_000, help="per-target request limit while faked")
+    parser.add_argument("--target-tpm", type=int, default=1_000_000_000, help="per-target token limit while faked")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the result as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed latency/throughput regression as a fraction")
+    parser.add_argument("--error-tolerance", type=float, default=0.01, help="allowed rise in the non-2xx share")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(n) for n in size.split("x")) for size in args.s3_image_sizes.split(",")]
+
+    def setup():
+        # Same seed per level, so levels differ only in concurrency
+        random.seed(args.seed)
+        install_fakes(
+            FakeBedrock(args.bedrock_latency, args.throttle_rate, seed=args.seed, output_tokens=args.output_tokens),
+            FakeS3(args.s3_latency, sizes, seed=args.seed),
+            args.target_rpm,
+            args.target_tpm,
+        )
+
+    corpus = load_corpus(args.corpus)
+    if args.endpoint:
+        corpus = [entry for entry in corpus if entry["endpoint"] in args.endpoint]
+        if not corpus:
+            parser.error(f"no corpus entries for {', '.join(args.endpoint)}")
+    # Pre-render fake photos so image generation doesn't count against the handlers
+    for size in sizes:
+        fake_jpeg(*size)
+    for entry in corpus:
+        if "image" in entry:
+            image_bytes(entry["image"])
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    levels = [None] if args.rate else args.concurrency
+    results = asyncio.run(sweep(corpus, args.requests or len(corpus), levels, args.rate, args.bypass_cache, setup))
+    result = results[0] if len(results) == 1 else {"levels": results}
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    result["memory_high_water_mb"] = round(rss_after / 1024, 1)
+    result["memory_growth_mb"] = round((rss_after - rss_before) / 1024, 1)
+    result["config"] = {k: v for k, v in vars(args).items() if k not in ("save", "compare")}
+
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance, args.error_tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
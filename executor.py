@@ -0,0 +1,118 @@
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from metrics import BACKEND_REJECTED, BACKEND_WAIT_SECONDS, record_timing
+
+
+class Saturated(Exception):
+    """Raised when a backend's queue is full; maps to a 429 with Retry-After."""
+
+    def __init__(self, backend, retry_after):
+        super().__init__(f"{backend} is saturated, retry in {retry_after}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class Backend:
+    """Runs blocking client calls (boto3) on a dedicated, bounded thread pool.
+
+    At most ``max_concurrency`` calls run at once; up to ``max_queue`` more
+    wait for a slot for at most ``queue_timeout`` seconds. Anything beyond
+    that is rejected with ``Saturated`` instead of piling up on the loop.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        # Created on first use: a semaphore binds to the loop it first waits on
+        self._slots = None
+        self._loop = None
+        # Moving average of call duration, used to size Retry-After
+        self._avg_seconds = 1.0
+
+    def retry_after(self):
+        backlog = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(self._avg_seconds * backlog))
+
+    async def submit(self, fn, *args, **kwargs):
+        """Wait for a slot and start ``fn`` on the pool.
+
+        Returns the asyncio future for the call; the slot is freed when it
+        completes. Raises ``Saturated`` before anything starts if the queue
+        is full, so callers can still answer with a 429.
+        """
+        slots = self._slots_for(asyncio.get_running_loop())
+        if slots.locked() and self.waiting >= self.max_queue:
+            BACKEND_REJECTED.inc(self.name)
+            raise Saturated(self.name, self.retry_after())
+
+        self.waiting += 1
+        queued = time.monotonic()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            BACKEND_REJECTED.inc(self.name)
+            raise Saturated(self.name, self.retry_after()) from None
+        finally:
+            self.waiting -= 1
+
+        return self._start(slots, queued, fn, args, kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        return await (await self.submit(fn, *args, **kwargs))
+
+    async def run_admitted(self, fn, *args, **kwargs):
+        """Run follow-up work of a request that was already admitted.
+
+        Waits for a slot however long it takes and doesn't count against
+        ``max_queue``, so one request's per-item calls can't turn each other
+        (or other requests) away with ``Saturated``. Callers bound how many
+        of these they have waiting.
+        """
+        slots = self._slots_for(asyncio.get_running_loop())
+        queued = time.monotonic()
+        await slots.acquire()
+        return await self._start(slots, queued, fn, args, kwargs)
+
+    def _start(self, slots, queued, fn, args, kwargs):
+        self.in_flight += 1
+        start = time.monotonic()
+        BACKEND_WAIT_SECONDS.observe(start - queued, self.name)
+        record_timing(f"{self.name}-wait", start - queued)
+        future = self._loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+        future.add_done_callback(lambda _: self._finished(slots, start))
+        return future
+
+    def _slots_for(self, loop):
+        if self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._slots
+
+    def _finished(self, slots, start):
+        self.in_flight -= 1
+        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - start)
+        slots.release()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def backend_from_env(name, default_concurrency):
+    prefix = name.upper()
+    concurrency = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", default_concurrency))
+    return Backend(
+        name,
+        max_concurrency=concurrency,
+        max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", concurrency * 4)),
+        queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", 30)),
+    )
@@ -0,0 +1,155 @@
+import functools
+import io
+import math
+import random
+import time
+import zlib
+
+from botocore.exceptions import ClientError
+from PIL import Image
+
+
+def distribution(spec, rng=random):
+    """Turn a spec into a zero-argument sampler.
+
+    ``"0.8"`` is a constant, ``"uniform:0.2:1.5"`` draws between the bounds and
+    ``"lognormal:0.8:0.5"`` draws around a median of 0.8 with the given sigma,
+    which is the usual shape of model latency.
+    """
+    if callable(spec):
+        return spec
+    if isinstance(spec, (int, float)):
+        return lambda: spec
+    kind, *args = str(spec).split(":")
+    if not args:
+        value = float(kind)
+        return lambda: value
+    args = [float(a) for a in args]
+    if kind == "uniform":
+        return lambda: rng.uniform(*args)
+    if kind == "lognormal":
+        median, sigma = args
+        return lambda: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown distribution: {spec}")
+
+
+@functools.lru_cache(maxsize=32)
+def fake_jpeg(width, height, quality=90):
+    # Noise compresses about as badly as a real photo, so payload sizes stay realistic
+    img = Image.effect_noise((width, height), 60).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def not_modified_error():
+    return ClientError(
+        {"Error": {"Code": "304", "Message": "Not Modified"}, "ResponseMetadata": {"HTTPStatusCode": 304}},
+        "GetObject",
+    )
+
+
+def throttling_error(operation):
+    return ClientError(
+        {
+            "Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."},
+            "ResponseMetadata": {"HTTPStatusCode": 429},
+        },
+        operation,
+    )
+
+
+class FakeBedrock:
+    """Stands in for bedrock-runtime: sleeps like a model call, no AWS needed.
+
+    ``throttle_rate`` is the fraction of calls that raise ThrottlingException,
+    which is how Bedrock reports exhausted RPM/TPM quotas. ``latency`` and
+    ``output_tokens`` take a number or a ``distribution`` spec.
+    """
+
+    def __init__(self, latency, throttle_rate=0.0, text="ok", seed=None, output_tokens=10):
+        self._random = random.Random(seed)
+        self.latency = distribution(latency, self._random)
+        self.output_tokens = distribution(output_tokens, self._random)
+        self.throttle_rate = throttle_rate
+        self.text = text
+        self.calls = 0
+
+    def _maybe_throttle(self, operation):
+        self.calls += 1
+        if self._random.random() < self.throttle_rate:
+            # Real throttles come back fast
+            time.sleep(self.latency() / 20)
+            raise throttling_error(operation)
+
+    def converse(self, **kwargs):
+        self._maybe_throttle("Converse")
+        latency = self.latency()
+        tokens = max(1, int(self.output_tokens()))
+        time.sleep(latency)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": " ".join([self.text] * tokens)}]}},
+            "stopReason": "end_turn",
+            "usage": {"inputTokens": 10, "outputTokens": tokens, "totalTokens": 10 + tokens},
+            "metrics": {"latencyMs": int(latency * 1000)},
+        }
+
+    def converse_stream(self, **kwargs):
+        self._maybe_throttle("ConverseStream")
+        return {"stream": FakeEventStream(self.latency(), self.text, max(1, int(self.output_tokens())))}
+
+
+class FakeEventStream:
+    """First token after a tenth of the latency, the rest spread over the remainder."""
+
+    def __init__(self, latency, text="ok", tokens=10):
+        self.latency = latency
+        self.text = text
+        self.tokens = tokens
+
+    def __iter__(self):
+        yield {"messageStart": {"role": "assistant"}}
+        time.sleep(self.latency / 10)
+        for _ in range(self.tokens):
+            yield {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": f"{self.text} "}}}
+            time.sleep(self.latency * 0.9 / self.tokens)
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        yield {
+            "metadata": {
+                "usage": {"inputTokens": 10, "outputTokens": self.tokens, "totalTokens": 10 + self.tokens},
+                "metrics": {"latencyMs": int(self.latency * 1000)},
+            }
+        }
+
+    def close(self):
+        pass
+
+
+class FakeS3:
+    """Stands in for the S3 client: photo-sized JPEGs per key, ETags, 304s and local presigning.
+
+    Each key maps to one of ``image_sizes`` (width, height) pairs, picked
+    from a hash of the key so repeat fetches of a key see the same object.
+    """
+
+    def __init__(self, latency, image_sizes=((1568, 1176),), seed=None):
+        self._random = random.Random(seed)
+        self.latency = distribution(latency, self._random)
+        self.image_sizes = list(image_sizes)
+        self.calls = 0
+
+    def _size(self, key):
+        return self.image_sizes[zlib.crc32(key.encode()) % len(self.image_sizes)]
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.calls += 1
+        time.sleep(self.latency())
+        width, height = self._size(Key)
+        etag = f'"{width}x{height}"'
+        if IfNoneMatch == etag:
+            raise not_modified_error()
+        data = fake_jpeg(width, height)
+        return {"ETag": etag, "ContentType": "image/jpeg", "ContentLength": len(data), "Body": io.BytesIO(data)}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.fake-s3.local/{Params['Key']}?op={operation}&expires={ExpiresIn}"
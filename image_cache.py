@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from botocore.exceptions import ClientError
+
+from metrics import timed
+
+CachedImage = namedtuple("CachedImage", ["etag", "content_type", "data", "width", "height"], defaults=(None, None))
+
+
+class ImageCache:
+    """Byte-bounded LRU of S3 objects keyed by bucket/key, validated by ETag.
+
+    Entries younger than ``fresh_seconds`` are served without touching S3.
+    Older ones are revalidated with If-None-Match, so an unchanged object
+    costs a 304 instead of a full download. When ``spill_dir`` is set,
+    entries evicted from memory are written there (up to ``spill_max_bytes``)
+    and read back before going to S3.
+
+    ``transform``, if given, turns downloaded bytes into a ``PreparedImage``
+    before they are cached, so resizing happens once per object version.
+
+    ``download`` blocks and belongs on the S3 worker pool; ``get_fresh`` only
+    looks at memory and is safe to call on the event loop. ``fetch_all``
+    runs the whole thing, with ``transform`` on its own (CPU) pool.
+    """
+
+    def __init__(self, client, max_bytes, fresh_seconds=300, spill_dir=None, spill_max_bytes=0, transform=None):
+        self.client = client
+        self.transform = transform
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (bucket, key) -> (CachedImage, checked_at)
+        self._bytes = 0
+        self._spilled = OrderedDict()  # (bucket, key) -> (CachedImage without data, path, size)
+        self._spilled_bytes = 0
+        self._in_flight = {}  # (bucket, key) -> task; only touched on the event loop
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Spill files are only indexed in memory, anything left from a previous run is orphaned
+            for name in os.listdir(spill_dir):
+                if name.endswith(".img"):
+                    os.remove(os.path.join(spill_dir, name))
+
+    def get_fresh(self, bucket, key):
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is None or time.monotonic() - entry[1] > self.fresh_seconds:
+                return None
+            self._entries.move_to_end((bucket, key))
+            self.hits += 1
+            return entry[0]
+
+    def download(self, bucket, key):
+        """Return ``(image, downloaded)``; downloaded images are raw bytes, not yet prepared or cached."""
+        cached = self.get_fresh(bucket, key)
+        if cached is not None:
+            return cached, False
+
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+        cached = entry[0] if entry else self._read_spill(bucket, key)
+
+        params = {"Bucket": bucket, "Key": key}
+        if cached is not None:
+            params["IfNoneMatch"] = cached.etag
+        try:
+            obj = self.client.get_object(**params)
+        except ClientError as e:
+            if cached is None or e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") != 304:
+                raise
+            self.revalidated += 1
+            self._store(bucket, key, cached)
+            return cached, False
+
+        self.misses += 1
+        return CachedImage(obj.get("ETag"), obj.get("ContentType"), obj["Body"].read()), True
+
+    def prepare(self, image):
+        if self.transform is None:
+            return image
+        prepared = self.transform(image.data)
+        return CachedImage(image.etag, f"image/{prepared.format}", prepared.data, prepared.width, prepared.height)
+
+    async def fetch_all(self, backend, bucket, keys, fanout, transform_backend=None):
+        """Fetch ``keys`` concurrently, at most ``fanout`` S3 calls at a time, in order.
+
+        Downloads run on ``backend`` and ``transform`` on ``transform_backend``
+        (``backend`` if not given), so decoding doesn't hold S3 slots. Only
+        the downloads go through admission control; the transforms and
+        stores that follow wait for a slot, at most one pool's worth at a
+        time, instead of being rejected because of this request's own keys.
+        Requests racing for the same uncached object share one download and
+        one transform instead of each decoding their own copy.
+        """
+        transform_backend = transform_backend or backend
+        limit = asyncio.Semaphore(fanout)
+        prepare_limit = asyncio.Semaphore(transform_backend.max_concurrency)
+
+        async def fetch_limited(key):
+            async with limit:
+                with timed("s3"):
+                    image, downloaded = await backend.run(self.download, bucket, key)
+            if not downloaded:
+                return image
+            if self.transform is not None:
+                async with prepare_limit:
+                    with timed("image"):
+                        image = await transform_backend.run_admitted(self.prepare, image)
+            async with limit:
+                # May spill evicted entries to disk
+                await backend.run_admitted(self._store, bucket, key, image)
+            return image
+
+        async def fetch_one(key):
+            cached = self.get_fresh(bucket, key)
+            if cached is not None:
+                return cached
+            task = self._in_flight.get((bucket, key))
+            if task is None:
+                task = asyncio.ensure_future(fetch_limited(key))
+                self._in_flight[(bucket, key)] = task
+                task.add_done_callback(lambda _: self._in_flight.pop((bucket, key), None))
+            return await asyncio.shield(task)
+
+        return await asyncio.gather(*(fetch_one(key) for key in keys))
+
+    def _store(self, bucket, key, image):
+        evicted = []
+        with self._lock:
+            old = self._entries.pop((bucket, key), None)
+            if old is not None:
+                self._bytes -= len(old[0].data)
+            if len(image.data) <= self.max_bytes:
+                self._entries[(bucket, key)] = (image, time.monotonic())
+                self._bytes += len(image.data)
+            else:
+                evicted.append(((bucket, key), image))
+            while self._bytes > self.max_bytes:
+                cache_key, (old_image, _) = self._entries.popitem(last=False)
+                self._bytes -= len(old_image.data)
+                evicted.append((cache_key, old_image))
+
+        if self.spill_dir:
+            for cache_key, old_image in evicted:
+                self._write_spill(cache_key, old_image)
+
+    def _spill_path(self, bucket, key, etag):
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode()).hexdigest()
+        return os.path.join(self.spill_dir, f"{digest}.img")
+
+    def _write_spill(self, cache_key, image):
+        size = len(image.data)
+        if size > self.spill_max_bytes:
+            return
+        path = self._spill_path(*cache_key, image.etag)
+        with open(path, "wb") as f:
+            f.write(image.data)
+
+        stale = []
+        with self._lock:
+            old = self._spilled.pop(cache_key, None)
+            if old is not None:
+                self._spilled_bytes -= old[2]
+                if old[1] != path:
+                    stale.append(old[1])
+            self._spilled[cache_key] = (image._replace(data=None), path, size)
+            self._spilled_bytes += size
+            while self._spilled_bytes > self.spill_max_bytes:
+                _, (_, old_path, old_size) = self._spilled.popitem(last=False)
+                self._spilled_bytes -= old_size
+                stale.append(old_path)
+
+        for old_path in stale:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def _read_spill(self, bucket, key):
+        if not self.spill_dir:
+            return None
+        with self._lock:
+            entry = self._spilled.get((bucket, key))
+        if entry is None:
+            return None
+        meta, path, _ = entry
+        try:
+            with open(path, "rb") as f:
+                return meta._replace(data=f.read())
+        except FileNotFoundError:
+            return None
+
+
+def image_cache_from_env(client, transform=None):
+    return ImageCache(
+        client,
+        max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+        fresh_seconds=float(os.getenv("IMAGE_CACHE_FRESH_SECONDS", 300)),
+        spill_dir=os.getenv("IMAGE_CACHE_SPILL_DIR") or None,
+        spill_max_bytes=int(os.getenv("IMAGE_CACHE_SPILL_MAX_BYTES", 2 * 1024 * 1024 * 1024)),
+        transform=transform,
+    )
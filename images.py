@@ -0,0 +1,200 @@
+import io
+import json
+import math
+import os
+from collections import namedtuple
+
+from PIL import Image, ImageOps
+
+try:
+    # HEIC/HEIF (iPhone photos) needs the optional pillow-heif plugin
+    from pillow_heif import register_heif_opener
+except ImportError:
+    register_heif_opener = None
+else:
+    register_heif_opener()
+
+MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 1568))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_INPUT_TOKENS = int(os.getenv("MAX_INPUT_TOKENS", 0))
+
+# Formats Bedrock accepts as-is
+BEDROCK_FORMATS = ("jpeg", "png", "gif", "webp")
+
+IMAGE_FORMATS = {
+    "image/jpeg": "jpeg",
+    "image/jpg": "jpeg",
+    "image/pjpeg": "jpeg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/heic": "heic",
+    "image/heif": "heic",
+}
+
+PreparedImage = namedtuple("PreparedImage", ["format", "data", "width", "height"])
+
+
+class ImageError(Exception):
+    status_code = 400
+
+
+class ImageTooLarge(ImageError):
+    status_code = 413
+
+
+class UnsupportedImage(ImageError):
+    status_code = 415
+
+
+def image_format(content_type, default="jpeg"):
+    # Ignore parameters like "; charset=..."; unknown types fall back to default
+    if not content_type:
+        return default
+    return IMAGE_FORMATS.get(content_type.split(";")[0].strip().lower(), default)
+
+
+def sniff_format(data):
+    """Detect the real image format from magic bytes, whatever the client claimed."""
+    head = bytes(data[:16])
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"heim", b"heis", b"hevc", b"mif1", b"msf1"):
+        return "heic"
+    return None
+
+
+async def read_upload(upload, max_bytes=MAX_UPLOAD_BYTES, chunk_size=256 * 1024):
+    """Read an UploadFile in chunks, giving up as soon as it passes ``max_bytes``."""
+    buf = bytearray()
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise ImageTooLarge(f"Image exceeds {max_bytes} bytes.")
+    return bytes(buf)
+
+
+class UploadLimitMiddleware:
+    """Rejects request bodies over ``max_bytes`` on ``paths`` before they are parsed.
+
+    Starlette spools a whole multipart body to disk before ``File(...)`` is
+    resolved, so ``read_upload`` alone only caps what we read back. This
+    answers 413 straight from Content-Length, and for chunked bodies stops
+    the parser as soon as the running total passes the limit.
+    """
+
+    def __init__(self, app, max_bytes, paths):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and int(value) > self.max_bytes:
+                return await self._reject(send)
+
+        received = 0
+        too_large = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Looks like a disconnect to the parser, which stops reading
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def limited_send(message):
+            # Whatever the app answers to the aborted body is replaced by the 413
+            if not too_large:
+                await send(message)
+
+        await self.app(scope, limited_receive, limited_send)
+        if too_large:
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({"error": f"Request body exceeds {self.max_bytes} bytes."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def prepare_image(data, max_dimension=MAX_DIMENSION, quality=JPEG_QUALITY):
+    """Downscale and recompress an image for the model. Blocking, CPU-bound.
+
+    Images already within ``max_dimension`` in a format Bedrock accepts are
+    passed through untouched. Anything larger is resized so its long edge is
+    ``max_dimension`` and re-encoded; HEIC is always converted to JPEG.
+    """
+    fmt = sniff_format(data)
+    if fmt is None:
+        raise UnsupportedImage("Unrecognized image format.")
+    if fmt == "heic" and register_heif_opener is None:
+        raise UnsupportedImage("HEIC images require the pillow-heif package.")
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        width, height = img.size
+        if fmt in BEDROCK_FORMATS and max(width, height) <= max_dimension:
+            return PreparedImage(fmt, data, width, height)
+
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if fmt in ("png", "gif"):
+            # Resizing drops GIF animation anyway; PNG keeps transparency
+            fmt = "png"
+            img.save(out, format="PNG", optimize=True)
+        elif fmt == "webp":
+            img.save(out, format="WEBP", quality=quality)
+        else:
+            fmt = "jpeg"
+            img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        raise UnsupportedImage(f"Could not decode image: {e}") from None
+
+    return PreparedImage(fmt, out.getvalue(), img.width, img.height)
+
+
+def estimate_image_tokens(width, height):
+    # Anthropic's published approximation for vision input
+    return math.ceil(width * height / 750)
+
+
+def estimate_text_tokens(text):
+    return math.ceil(len(text) / 4)
+
+
+def check_input_tokens(images, text, limit=MAX_INPUT_TOKENS):
+    """Estimate input tokens before the model call; reject above ``limit`` (0 means no limit)."""
+    tokens = sum(estimate_image_tokens(img.width, img.height) for img in images) + estimate_text_tokens(text)
+    return check_token_limit(tokens, limit)
+
+
+def check_token_limit(tokens, limit=MAX_INPUT_TOKENS):
+    if limit and tokens > limit:
+        raise ImageTooLarge(f"Request is estimated at {tokens} input tokens, over the limit of {limit}.")
+    return tokens
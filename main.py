@@ -1,51 +1,198 @@
 from fastapi import FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import boto3
 from botocore.config import Config
+import asyncio
 import json
-import uuid
+import logging
 import os
-
-app = FastAPI()
+from contextlib import asynccontextmanager
+
+from batching import GRAMMAR_PROMPT, batch_prompt, pack, split_batch
+from executor import Saturated, backend_from_env
+from image_cache import image_cache_from_env
+import metrics
+from images import MAX_UPLOAD_BYTES, ImageError, UploadLimitMiddleware, check_input_tokens, check_token_limit, estimate_text_tokens, image_format, prepare_image, read_upload
+from response_cache import cache_key, cacheable, response_cache_from_env
+from presign import sign_upload, url_cache_from_env
+from router import ModelUnavailable, router_from_env
+from sessions import sessions_from_env
+from streaming import ConverseStreamResponse, open_converse_stream
+
+# Blocking boto3 calls run on per-backend thread pools so the event loop stays free.
+# The botocore connection pool is sized to match, otherwise threads queue on urllib3.
+bedrock_backend = backend_from_env("bedrock", 16)
+s3_backend = backend_from_env("s3", 32)
+image_backend = backend_from_env("image", os.cpu_count() or 4)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    bedrock_backend.shutdown()
+    s3_backend.shutdown()
+    image_backend.shutdown()
+
+
+# One JSON line per request on stderr; LOG_LEVEL=WARNING turns it off
+request_log = logging.getLogger("gateway")
+request_log.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+request_log.addHandler(logging.StreamHandler())
+request_log.propagate = False
+app = FastAPI(lifespan=lifespan)
 MODEL_ID = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
+FAST_MODEL_ID = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
+
+# Ordered (region, model) targets per endpoint; override with MODEL_ROUTES (same shape, as JSON).
+# Session cache points are only sent to targets with "prompt_caching": true, which Bedrock
+# supports for e.g. Claude 3.7 Sonnet and 3.5 Haiku but not for Claude 3.5 Sonnet v2.
+DEFAULT_ROUTES = {
+    "narrative": [
+        {"region": "us-east-1", "model": MODEL_ID},
+        {"region": "us-west-2", "model": MODEL_ID},
+    ],
+    "summary": [
+        {"region": "us-east-1", "model": MODEL_ID},
+        {"region": "us-west-2", "model": MODEL_ID},
+    ],
+    "grammar": [
+        {"region": "us-east-1", "model": FAST_MODEL_ID},
+        {"region": "us-west-2", "model": FAST_MODEL_ID},
+        {"region": "us-east-1", "model": MODEL_ID},
+    ],
+}
+
+
+def bedrock_client(region):
+    # The router does its own retries and failover, so botocore shouldn't retry underneath it
+    return boto3.client(
+        "bedrock-runtime",
+        region_name=region,
+        config=Config(
+            max_pool_connections=bedrock_backend.max_concurrency,
+            retries={"mode": "standard", "max_attempts": 1},
+        ),
+    )
+
+
+router = router_from_env(DEFAULT_ROUTES, bedrock_backend, bedrock_client)
+
+
+response_cache = response_cache_from_env()
+
+
+def cache_bypassed(request):
+    return (
+        request.headers.get("x-cache-bypass", "").lower() in ("1", "true")
+        or "no-cache" in request.headers.get("cache-control", "")
+    )
+
+
+async def converse(request, route, tokens=0, **kwargs):
+    # Identical prompts (same route, text and image bytes) are answered from cache or share one call.
+    # The route's models are part of the key so a MODEL_ROUTES change doesn't serve old-model answers.
+    async def call():
+        return cacheable(await router.converse(route, tokens, **kwargs))
+
+    models = [target.model_id for target in router.routes[route]]
+    key = cache_key(route=route, models=models, **kwargs)
+    return await response_cache.get_or_call(key, call, bypass=cache_bypassed(request))
+
+
+def error_response(e):
+    if isinstance(e, Saturated):
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    if isinstance(e, ModelUnavailable):
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    if isinstance(e, ImageError):
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+async def stream_response(route, tokens=0, **kwargs):
+    # Opt-in SSE mode: relays converse_stream deltas, the final "done" event carries usage.
+    # Failover only happens while opening the stream, never mid-answer.
+    def open_stream(target):
+        return open_converse_stream(
+            bedrock_backend,
+            router.client(target.region),
+            on_usage=lambda usage: target.charge(tokens, usage),
+            modelId=target.model_id,
+            **target.request(kwargs),
+        )
+
+    stream = await router.call(route, tokens, open_stream)
+    return ConverseStreamResponse(
+        stream,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 @app.post("/generate-narrative")
-async def generate_narrative(prompt: str = Form(...), image: UploadFile = File(None)):
+async def generate_narrative(request: Request, prompt: str = Form(...), image: UploadFile = File(None), stream: bool = False):
     try:
         # Build message content
         content = []
 
-        # Add image if provided
+        images = []
+
+        # Add image if provided, downscaled off the event loop
         if image:
-            image_bytes = await image.read()
+            image_bytes = await read_upload(image)
+            metrics.IMAGE_BYTES.observe(len(image_bytes), "upload")
+            with metrics.timed("image"):
+                prepared = await image_backend.run(prepare_image, image_bytes)
+            metrics.IMAGE_BYTES.observe(len(prepared.data), "prepared")
+            images.append(prepared)
             content.append({
                 "image": {
-                    "format": image.content_type.split("/")[-1],  # e.g., "png", "jpeg"
-                    "source": {"bytes": image_bytes}
+                    "format": prepared.format,
+                    "source": {"bytes": prepared.data}
                 }
             })
 
         # Add prompt text
         content.append({"text": prompt})
+        tokens = check_input_tokens(images, prompt)
 
         messages = [{"role": "user", "content": content}]
 
-        response = bedrock.converse(
-            modelId=MODEL_ID,
+        if stream:
+            return await stream_response("narrative", tokens, messages=messages)
+
+        response = await converse(
+            request,
+            "narrative",
+            tokens,
             messages=messages
         )
 
         output_text = response["output"]["message"]["content"][0]["text"]
-        return {"model": MODEL_ID, "result": output_text}
+        return {"model": response.get("modelId", MODEL_ID), "result": output_text}
 
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        return error_response(e)
 
 
-sigv4_config = Config(signature_version='s3v4')
-s3 = boto3.client("s3", region_name="us-east-2", config=sigv4_config)
+sigv4_config = Config(signature_version='s3v4', max_pool_connections=s3_backend.max_concurrency)
+S3_REGION = "us-east-2"
+s3 = boto3.client("s3", region_name=S3_REGION, config=sigv4_config)
 BUCKET_NAME = "area-of-origin-images"
+url_cache = url_cache_from_env(s3, BUCKET_NAME)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+image_cache = image_cache_from_env(s3, transform=prepare_image)
+S3_FETCH_FANOUT = int(os.getenv("S3_FETCH_FANOUT", 8))
+sessions = sessions_from_env()
+GRAMMAR_BATCH_TOKENS = int(os.getenv("GRAMMAR_BATCH_TOKENS", 2000))
+GRAMMAR_BATCH_MAX_ITEMS = int(os.getenv("GRAMMAR_BATCH_MAX_ITEMS", 25))
 
 
 @app.post("/generate-upload-url")
@@ -54,77 +201,147 @@ async def generate_upload_url(request: Request):
         data = await request.json()
         content_type = data.get("content_type", "image/jpeg")
 
-        file_ext = "jpg" if "jpeg" in content_type else "png"
-        file_key = f"uploads/{uuid.uuid4()}.{file_ext}"
-
-        # ✅ Generate presigned PUT URL
-        presigned_url = s3.generate_presigned_url(
-            "put_object",
-            Params={
-                "Bucket": BUCKET_NAME,
-                "Key": file_key,
-                "ContentType": content_type
-            },
-            ExpiresIn=900
-        )
+        with metrics.timed("presign"):
+            return await s3_backend.run(sign_upload, s3, BUCKET_NAME, S3_REGION, content_type)
+
+    except Exception as e:
+        return error_response(e)
+
+
+def is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
 
-        return {
-            "upload_url": presigned_url,
-            "file_url": f"https://{BUCKET_NAME}.s3.us-east-2.amazonaws.com/{file_key}"
-        }
+
+@app.post("/generate-upload-url/batch")
+async def generate_upload_urls(request: Request):
+    try:
+        data = await request.json()
+        content_types = data.get("content_types")
+        if content_types is None:
+            count = data.get("count", 0)
+            if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+                return JSONResponse(status_code=400, content={"error": "count must be a non-negative integer."})
+            # One past the limit is enough to be rejected below
+            content_types = ["image/jpeg"] * min(count, BATCH_MAX_ITEMS + 1)
+
+        if not is_string_list(content_types):
+            return JSONResponse(status_code=400, content={"error": "content_types must be a list of strings."})
+        if not content_types:
+            return JSONResponse(status_code=400, content={"error": "No content types provided."})
+        if len(content_types) > BATCH_MAX_ITEMS:
+            return JSONResponse(status_code=400, content={"error": f"At most {BATCH_MAX_ITEMS} URLs per batch."})
+
+        # One trip to the S3 pool signs the whole batch
+        with metrics.timed("presign"):
+            uploads = await s3_backend.run(
+                lambda: [sign_upload(s3, BUCKET_NAME, S3_REGION, content_type) for content_type in content_types]
+            )
+        return {"uploads": uploads}
 
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        return error_response(e)
 
 @app.get("/get-image-url")
-def get_image_url(key: str):
+async def get_image_url(key: str):
     try:
-        url = s3.generate_presigned_url(
-            "get_object",
-            Params={
-                "Bucket": BUCKET_NAME,
-                "Key": key
-            },
-            ExpiresIn=900
-        )
+        with metrics.timed("presign"):
+            url = await s3_backend.run(url_cache.get, key)
         return {"presigned_url": url}
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        return error_response(e)
+
+
+@app.post("/get-image-url/batch")
+async def get_image_urls(request: Request):
+    try:
+        data = await request.json()
+        keys = data.get("keys", [])
+
+        if not is_string_list(keys):
+            return JSONResponse(status_code=400, content={"error": "keys must be a list of strings."})
+        if not keys:
+            return JSONResponse(status_code=400, content={"error": "No keys provided."})
+        if len(keys) > BATCH_MAX_ITEMS:
+            return JSONResponse(status_code=400, content={"error": f"At most {BATCH_MAX_ITEMS} URLs per batch."})
+
+        with metrics.timed("presign"):
+            urls = await s3_backend.run(url_cache.get_many, keys)
+        return {"presigned_urls": urls}
+    except Exception as e:
+        return error_response(e)
+
+
+async def continue_session(session, question):
+    # Turns in one session run one at a time so history stays in order
+    async with session.lock:
+        tokens = check_token_limit(session.tokens + estimate_text_tokens(question))
+        response = await router.converse("summary", tokens, messages=session.request_messages(question))
+        answer = response["output"]["message"]
+        session.record(question, answer)
+        sessions.touched(session)
+
+    return {
+        "summary": answer["content"][0]["text"],
+        "session_id": session.id,
+        # cacheReadInputTokens / cacheWriteInputTokens show what the cache points saved
+        "usage": response.get("usage"),
+        "metrics": response.get("metrics"),
+    }
 
-import requests
-import base64
 
 @app.post("/generate-summary")
-async def generate_summary(request: Request):
+async def generate_summary(request: Request, stream: bool = False):
     try:
         body = await request.json()
         image_keys = body.get("image_keys", [])
         user_prompt = body.get("prompt", "")
+        session_id = body.get("session_id")
+        use_session = bool(body.get("session") or session_id)
 
-        if not image_keys:
-            return JSONResponse(status_code=400, content={"error": "No image keys provided."})
+        if use_session and stream:
+            return JSONResponse(status_code=400, content={"error": "Streaming is not supported with sessions."})
 
-        image_contents = []
+        # Follow-up in an existing session: only the new question is added
+        session = sessions.get(session_id) if session_id else None
+        if session is not None:
+            return await continue_session(session, user_prompt)
+        if session_id and not image_keys:
+            return JSONResponse(status_code=404, content={"error": "Session expired or not found."})
 
-        for key in image_keys:
-            # Fetch image bytes from S3
-            obj = s3.get_object(Bucket=BUCKET_NAME, Key=key)
-            image_bytes = obj["Body"].read()
+        if not image_keys:
+            return JSONResponse(status_code=400, content={"error": "No image keys provided."})
 
-            # Encode image in base64
-            encoded_image = base64.b64encode(image_bytes).decode("utf-8")
+        # Fetch all images concurrently; repeat keys are served from the cache
+        with metrics.timed("images"):
+            images = await image_cache.fetch_all(s3_backend, BUCKET_NAME, image_keys, S3_FETCH_FANOUT, image_backend)
+        for img in images:
+            metrics.IMAGE_BYTES.observe(len(img.data), "prepared")
 
-            image_contents.append({
+        image_contents = [
+            {
                 "image": {
-                    "format": "jpeg",
+                    "format": image_format(img.content_type),
                     "source": {
-                        "bytes": encoded_image
+                        "bytes": img.data
                     }
                 }
-            })
+            }
+            for img in images
+        ]
+
+        if use_session:
+            # Unknown or expired session IDs with image keys start over under a new ID
+            session = sessions.create(image_contents, check_input_tokens(images, ""))
+            try:
+                return await continue_session(session, user_prompt)
+            except Exception:
+                # Nobody has the ID yet, so the session would only hold memory until evicted
+                sessions.discard(session)
+                raise
 
         # Add the user prompt
         image_contents.append({"text": user_prompt})
+        tokens = check_input_tokens(images, user_prompt)
 
         # Construct the Claude messages
         messages = [
@@ -134,8 +351,13 @@ async def generate_summary(request: Request):
             }
         ]
 
-        response = bedrock.converse(
-            modelId=MODEL_ID,
+        if stream:
+            return await stream_response("summary", tokens, messages=messages)
+
+        response = await converse(
+            request,
+            "summary",
+            tokens,
             messages=messages,
         )
 
@@ -143,7 +365,17 @@ async def generate_summary(request: Request):
         return {"summary": output}
 
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        return error_response(e)
+
+
+async def ask_grammar(request, prompt):
+    response = await converse(
+        request,
+        "grammar",
+        estimate_text_tokens(prompt),
+        messages=[{"role": "user", "content": [{"text": prompt}]}],
+    )
+    return response["output"]["message"]["content"][0]["text"].strip()
 
 
 @app.post("/grammar-check")
@@ -152,28 +384,81 @@ async def grammar_check(request: Request):
         data = await request.json()
         original_text = data.get("text", "")
 
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "text": (
-                            "Please review the following text and improve its grammar, punctuation, and clarity "
-                            "without changing its tone or meaning. Only return the corrected version, without explanation.\n\n"
-                            f"{original_text}"
-                        )
-                    }
-                ]
-            }
-        ]
+        output_text = await ask_grammar(request, GRAMMAR_PROMPT + original_text)
+        return {"corrected": output_text}
 
-        response = bedrock.converse(
-            modelId=MODEL_ID,
-            messages=messages,
-        )
+    except Exception as e:
+        return error_response(e)
 
-        output_text = response["output"]["message"]["content"][0]["text"]
-        return {"corrected": output_text.strip()}
+
+@app.post("/grammar-check/batch")
+async def grammar_check_batch(request: Request):
+    try:
+        data = await request.json()
+        texts = data.get("texts", [])
+
+        if not is_string_list(texts):
+            return JSONResponse(status_code=400, content={"error": "texts must be a list of strings."})
+        if not texts:
+            return JSONResponse(status_code=400, content={"error": "No texts provided."})
+        if len(texts) > BATCH_MAX_ITEMS:
+            return JSONResponse(status_code=400, content={"error": f"At most {BATCH_MAX_ITEMS} texts per batch."})
+
+        corrected = [None] * len(texts)
+
+        async def run_batch(indices):
+            if len(indices) == 1:
+                # Same prompt as /grammar-check, so the two share cache entries
+                corrected[indices[0]] = await ask_grammar(request, GRAMMAR_PROMPT + texts[indices[0]])
+                return
+            output = await ask_grammar(request, batch_prompt([texts[i] for i in indices]))
+            results = split_batch(output, len(indices))
+            for i, result in zip(indices, results):
+                corrected[i] = result
+            # Paragraphs the model dropped or mangled are retried on their own
+            missing = [i for i, result in zip(indices, results) if result is None]
+            await asyncio.gather(*(run_batch([i]) for i in missing))
+
+        batches = pack(texts, GRAMMAR_BATCH_TOKENS, GRAMMAR_BATCH_MAX_ITEMS)
+        await asyncio.gather(*(run_batch(indices) for indices in batches))
+        return {"corrected": corrected}
 
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
\ No newline at end of file
+        return error_response(e)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+backends = (bedrock_backend, s3_backend, image_backend)
+metrics.Callback(
+    "gateway_backend_in_flight", "Calls running on a worker pool.", "gauge", ("backend",),
+    lambda: {(b.name,): b.in_flight for b in backends},
+)
+metrics.Callback(
+    "gateway_backend_queued", "Calls waiting for a worker slot.", "gauge", ("backend",),
+    lambda: {(b.name,): b.waiting for b in backends},
+)
+metrics.Callback(
+    "gateway_cache_events_total", "Cache lookups by cache and result.", "counter", ("cache", "result"),
+    lambda: {
+        ("response", "hit"): response_cache.hits,
+        ("response", "miss"): response_cache.misses,
+        ("response", "coalesced"): response_cache.coalesced,
+        ("response", "bypass"): response_cache.bypassed,
+        ("image", "hit"): image_cache.hits,
+        ("image", "miss"): image_cache.misses,
+        ("image", "revalidated"): image_cache.revalidated,
+        ("presign", "hit"): url_cache.hits,
+        ("presign", "miss"): url_cache.misses,
+    },
+)
+metrics.Callback(
+    "gateway_sessions", "Live summary sessions.", "gauge", (),
+    lambda: {(): len(sessions)},
+)
+# Uploads are capped before multipart parsing; the slack covers the other form fields
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES + 64 * 1024, paths={"/generate-narrative"})
+app.add_middleware(metrics.MetricsMiddleware, routes={route.path for route in app.routes})
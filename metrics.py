@@ -0,0 +1,220 @@
+import bisect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+log = logging.getLogger("gateway.requests")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1 KiB .. 64 MiB
+
+REGISTRY = []
+
+# Per-request timing breakdown, filled in by timed() and sent back as Server-Timing
+_timings = ContextVar("timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Callback:
+    """Metric whose values are read at scrape time, e.g. counters kept by a cache."""
+
+    def __init__(self, name, help, type, labels, collect):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = labels
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def samples(self):
+        for labels, value in self.collect().items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def samples(self):
+        names = self.labels + ("le",)
+        for labels, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), entry[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(names, labels + (bound,)), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, labels), entry[-1]
+            yield f"{self.name}_count", _format_labels(self.labels, labels), cumulative
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram("gateway_request_seconds", "HTTP request latency.", ("route", "method", "status"))
+REQUESTS_IN_FLIGHT = Gauge("gateway_requests_in_flight", "HTTP requests being handled.", ("route",))
+REQUEST_BYTES = Histogram("gateway_request_bytes", "HTTP request body size.", ("route",), SIZE_BUCKETS)
+
+BACKEND_WAIT_SECONDS = Histogram("gateway_backend_wait_seconds", "Time spent waiting for a worker slot.", ("backend",))
+BACKEND_REJECTED = Counter("gateway_backend_rejected_total", "Calls rejected because a backend was saturated.", ("backend",))
+
+BEDROCK_SECONDS = Histogram("gateway_bedrock_seconds", "Bedrock call latency seen by the gateway.", ("model", "region", "outcome"))
+BEDROCK_SERVER_SECONDS = Histogram("gateway_bedrock_server_seconds", "Bedrock-reported latency (metrics.latencyMs).", ("model",))
+BEDROCK_TOKENS = Counter("gateway_bedrock_tokens_total", "Tokens reported in Bedrock usage.", ("model", "kind"))
+BEDROCK_ERRORS = Counter("gateway_bedrock_errors_total", "Bedrock errors by type, throttles included.", ("model", "region", "code"))
+
+OPERATION_SECONDS = Histogram("gateway_operation_seconds", "Time spent in S3, presign and image operations.", ("operation",))
+IMAGE_BYTES = Histogram("gateway_image_bytes", "Image payload size.", ("stage",), SIZE_BUCKETS)
+
+USAGE_KINDS = {
+    "inputTokens": "input",
+    "outputTokens": "output",
+    "cacheReadInputTokens": "cache_read",
+    "cacheWriteInputTokens": "cache_write",
+}
+
+
+def record_timing(name, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(operation):
+    """Time a block into OPERATION_SECONDS and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        OPERATION_SECONDS.observe(elapsed, operation)
+        record_timing(operation, elapsed)
+
+
+def record_bedrock(model, region, seconds, response=None, error_code=None):
+    outcome = "error" if error_code else "ok"
+    BEDROCK_SECONDS.observe(seconds, model, region, outcome)
+    record_timing("bedrock", seconds)
+    if error_code:
+        BEDROCK_ERRORS.inc(model, region, error_code)
+    if response:
+        record_usage(model, response.get("usage"), response.get("metrics"))
+
+
+def record_usage(model, usage, bedrock_metrics=None):
+    for key, kind in USAGE_KINDS.items():
+        if usage and usage.get(key):
+            BEDROCK_TOKENS.inc(model, kind, amount=usage[key])
+    if bedrock_metrics and "latencyMs" in bedrock_metrics:
+        BEDROCK_SERVER_SECONDS.observe(bedrock_metrics["latencyMs"] / 1000, model)
+
+
+class MetricsMiddleware:
+    """Per-route latency, concurrency and request size, plus Server-Timing and a JSON log line.
+
+    Plain ASGI rather than BaseHTTPMiddleware so streaming responses pass
+    straight through and the per-request cost stays at a few dict updates.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        route = path if path in self.routes else "other"
+        method = scope["method"]
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                REQUEST_BYTES.observe(int(value), route)
+                break
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings["total"] = time.perf_counter() - start
+                header = ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(route)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUESTS_IN_FLIGHT.inc(route, amount=-1)
+            elapsed = time.perf_counter() - start
+            REQUEST_SECONDS.observe(elapsed, route, method, status)
+            _timings.reset(token)
+            if log.isEnabledFor(logging.INFO):
+                timings["total"] = elapsed
+                log.info(json.dumps({
+                    "route": route,
+                    "method": method,
+                    "status": status,
+                    "ms": {name: round(seconds * 1000, 1) for name, seconds in timings.items()},
+                }))
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+URL_EXPIRES_IN = 900
+
+
+class PresignedUrlCache:
+    """Reuses signed GET URLs per key until they get within ``min_remaining`` seconds of expiry.
+
+    Signing is local CPU work, but a gallery re-signs every image on each
+    load; handing back the same URL also lets browsers cache the image.
+    Calls block briefly (credential refresh can hit the network), so run
+    them on the S3 worker pool.
+    """
+
+    def __init__(self, client, bucket, expires_in=URL_EXPIRES_IN, min_remaining=300, max_entries=10000):
+        self.client = client
+        self.bucket = bucket
+        self.expires_in = expires_in
+        self.min_remaining = min_remaining
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()  # key -> (url, expires_at)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._urls.get(key)
+            if entry is not None and entry[1] - now > self.min_remaining:
+                self._urls.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        self.misses += 1
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=self.expires_in,
+        )
+        with self._lock:
+            self._urls[key] = (url, now + self.expires_in)
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return url
+
+    def get_many(self, keys):
+        return {key: self.get(key) for key in keys}
+
+
+def sign_upload(client, bucket, region, content_type):
+    file_ext = "jpg" if "jpeg" in content_type else "png"
+    file_key = f"uploads/{uuid.uuid4()}.{file_ext}"
+
+    # ✅ Generate presigned PUT URL
+    presigned_url = client.generate_presigned_url(
+        "put_object",
+        Params={
+            "Bucket": bucket,
+            "Key": file_key,
+            "ContentType": content_type
+        },
+        ExpiresIn=URL_EXPIRES_IN
+    )
+
+    return {
+        "upload_url": presigned_url,
+        "file_url": f"https://{bucket}.s3.{region}.amazonaws.com/{file_key}"
+    }
+
+
+def url_cache_from_env(client, bucket):
+    return PresignedUrlCache(
+        client,
+        bucket,
+        min_remaining=float(os.getenv("PRESIGN_MIN_REMAINING", 300)),
+        max_entries=int(os.getenv("PRESIGN_CACHE_MAX_ENTRIES", 10000)),
+    )
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(**kwargs):
+    """Content hash of a converse call: route or model ID, prompt text and image digests.
+
+    Image bytes are replaced by their SHA-256 so the key stays small and the
+    same photo uploaded twice hashes the same.
+    """
+
+    def normalize(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return {"sha256": hashlib.sha256(value).hexdigest()}
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    payload = json.dumps(normalize(kwargs), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cacheable(response):
+    # Only what the handlers read; ResponseMetadata differs per call and isn't worth storing
+    return {k: response[k] for k in ("output", "stopReason", "usage", "metrics", "modelId") if k in response}
+
+
+class MemoryStore:
+    """LRU of JSON-serializable values with per-entry expiry, bounded by encoded size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] < time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, time.time() + ttl)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class SqliteStore:
+    """On-disk store that survives restarts. Calls block; run them off the loop."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+        )
+        self._writes = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+
+
+class ResponseCache:
+    """Caches model responses and coalesces identical in-flight calls.
+
+    Lookups go to the in-memory LRU first, then the optional persistent
+    store. On a miss the first caller starts the model call; concurrent
+    callers with the same key await that same call instead of making their
+    own. Errors are shared with the waiters but never cached.
+    """
+
+    def __init__(self, memory, persistent=None, ttl=3600):
+        self.memory = memory
+        self.persistent = persistent
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self._in_flight = {}
+
+    async def get_or_call(self, key, call, bypass=False):
+        if bypass:
+            # Skip the lookup but refresh the stored value with the new answer
+            self.bypassed += 1
+            value = await call()
+            await self._set(key, value)
+            return value
+
+        value = await self._get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._call_and_store(key, call))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded so one caller disconnecting doesn't cancel the call for everyone
+        return await asyncio.shield(task)
+
+    async def _call_and_store(self, key, call):
+        value = await call()
+        await self._set(key, value)
+        return value
+
+    async def _get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            value = await asyncio.to_thread(self.persistent.get, key)
+            if value is not None:
+                self.memory.set(key, value, self.ttl)
+        return value
+
+    async def _set(self, key, value):
+        self.memory.set(key, value, self.ttl)
+        if self.persistent is not None:
+            await asyncio.to_thread(self.persistent.set, key, value, self.ttl)
+
+
+def response_cache_from_env():
+    path = os.getenv("RESPONSE_CACHE_PATH")
+    return ResponseCache(
+        MemoryStore(int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))),
+        persistent=SqliteStore(path) if path else None,
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+    )
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import math
+import os
+import random
+import time
+
+from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+from executor import Saturated
+from metrics import record_bedrock
+
+# Errors worth retrying on another target; anything else (validation, access) is raised as-is
+RETRYABLE_CODES = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "InternalServerException",
+}
+THROTTLE_CODES = {"ThrottlingException"}
+
+
+def error_code(e):
+    if isinstance(e, ClientError):
+        return e.response.get("Error", {}).get("Code")
+    return None
+
+
+def is_retryable(e):
+    return error_code(e) in RETRYABLE_CODES or isinstance(
+        e, (ReadTimeoutError, ConnectTimeoutError, EndpointConnectionError)
+    )
+
+
+def strip_cache_points(kwargs):
+    """Copy of converse ``kwargs`` without ``cachePoint`` blocks, for models that can't cache prompts."""
+    stripped = dict(kwargs)
+    if "messages" in kwargs:
+        stripped["messages"] = [
+            {**message, "content": [block for block in message["content"] if "cachePoint" not in block]}
+            for message in kwargs["messages"]
+        ]
+    if "system" in kwargs:
+        stripped["system"] = [block for block in kwargs["system"] if "cachePoint" not in block]
+    return stripped
+
+
+class ModelUnavailable(Exception):
+    """Every target for a route was throttled, rate limited or failing."""
+
+    def __init__(self, route, retry_after, throttled, last_error=None):
+        detail = f": {last_error}" if last_error else ""
+        super().__init__(f"No model available for {route}{detail}")
+        self.route = route
+        self.retry_after = retry_after
+        self.status_code = 429 if throttled else 503
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units per minute, scaled down while a target is throttling."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.scale = 1.0
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        rate = self.capacity / 60 * self.scale
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * rate)
+        self._updated = now
+
+    def available(self, n):
+        self._refill()
+        return self.tokens >= min(n, self.capacity)
+
+    def take(self, n):
+        # May go negative: a large request borrows from the next refill
+        self.tokens -= n
+
+    def refund(self, n):
+        self.tokens = min(self.capacity, self.tokens + n)
+
+    def wait_time(self, n):
+        self._refill()
+        missing = min(n, self.capacity) - self.tokens
+        return max(0.0, missing / (self.capacity / 60 * self.scale))
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures; after ``cooldown`` lets one trial call through."""
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_from = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            return False
+        # Half-open: re-arm so only this trial gets through until it reports back
+        self._trial_from = self.opened_at
+        self.opened_at = now
+        return True
+
+    def abandon(self):
+        # The allowed call never reached the target; let the next one be the trial instead
+        if self._trial_from is not None and self.opened_at is not None:
+            self.opened_at = self._trial_from
+        self._trial_from = None
+
+    def remaining(self):
+        """Seconds until a trial call is let through; 0 while closed."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_from = None
+
+    def failure(self):
+        self._trial_from = None
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class Target:
+    """One (region, model) pair with its own RPM/TPM buckets and circuit breaker.
+
+    ``prompt_caching`` marks models Bedrock supports cache points for; other
+    targets get requests with the cache points stripped.
+    """
+
+    def __init__(self, region, model_id, rpm, tpm, breaker, prompt_caching=False):
+        self.region = region
+        self.model_id = model_id
+        self.prompt_caching = prompt_caching
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.breaker = breaker
+
+    def __repr__(self):
+        return f"Target({self.region}, {self.model_id})"
+
+    def request(self, kwargs):
+        return kwargs if self.prompt_caching else strip_cache_points(kwargs)
+
+    def has_capacity(self, tokens):
+        return self.requests.available(1) and self.tokens.available(tokens)
+
+    def acquire(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def refund(self, tokens):
+        self.requests.refund(1)
+        self.tokens.refund(tokens)
+
+    def wait_time(self, tokens):
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def succeeded(self, estimated_tokens, usage):
+        self.breaker.success()
+        # Additive recovery after a throttle-induced slowdown
+        for bucket in (self.requests, self.tokens):
+            bucket.scale = min(1.0, bucket.scale + 0.05)
+        if usage:
+            self.charge(estimated_tokens, usage)
+
+    def charge(self, estimated_tokens, usage):
+        # Charge what the call really cost, not the up-front estimate
+        self.tokens.take(usage.get("inputTokens", 0) + usage.get("outputTokens", 0) - estimated_tokens)
+
+    def failed(self, throttled):
+        self.breaker.failure()
+        if throttled:
+            # Multiplicative decrease: slow this target down until calls succeed again
+            for bucket in (self.requests, self.tokens):
+                bucket.scale = max(0.1, bucket.scale / 2)
+
+
+class ModelRouter:
+    """Sends converse calls to the first healthy target of a route, failing over on throttles.
+
+    Each route is an ordered list of targets. A target is skipped when its
+    breaker is open or its rate limit has no room. Retryable errors (throttles,
+    timeouts, 5xx) move on to the next target; when a whole pass fails the
+    router sleeps with full-jitter exponential backoff and tries again, up
+    to ``max_attempts`` passes.
+
+    Clients come from ``client_factory(region)``, so tests can hand in a fake.
+    """
+
+    def __init__(self, routes, backend, client_factory, max_attempts=3, base_backoff=0.25, max_backoff=4.0):
+        self.routes = routes
+        self.backend = backend
+        self.client_factory = client_factory
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.clients = {}
+
+    def client(self, region):
+        if region not in self.clients:
+            self.clients[region] = self.client_factory(region)
+        return self.clients[region]
+
+    def reset_clients(self, client_factory):
+        self.client_factory = client_factory
+        self.clients.clear()
+
+    async def converse(self, route, tokens=0, **kwargs):
+        """Run ``converse`` on the route's targets; the response gains a ``modelId`` key."""
+
+        async def call(target):
+            response = await self.backend.run(
+                self.client(target.region).converse, modelId=target.model_id, **target.request(kwargs)
+            )
+            response["modelId"] = target.model_id
+            return response
+
+        return await self.call(route, tokens, call)
+
+    async def call(self, route, tokens, fn):
+        """Await ``fn(target)`` on the first target that accepts it, failing over on retryable errors."""
+        last_error = None
+        # 429 only if our limits or Bedrock's did the refusing; failing targets mean 503
+        throttled = False
+        for attempt in range(self.max_attempts):
+            wait = math.inf
+            for target in self.routes[route]:
+                if not target.has_capacity(tokens):
+                    throttled = True
+                    wait = min(wait, target.wait_time(tokens))
+                    continue
+                if not target.breaker.allow():
+                    continue
+                target.acquire(tokens)
+                start = time.perf_counter()
+                try:
+                    result = await fn(target)
+                except Saturated:
+                    # Our own pool was full: Bedrock never saw the call, so its limits and breaker are untouched
+                    target.refund(tokens)
+                    target.breaker.abandon()
+                    raise
+                except Exception as e:
+                    record_bedrock(
+                        target.model_id, target.region, time.perf_counter() - start,
+                        error_code=error_code(e) or type(e).__name__,
+                    )
+                    if not is_retryable(e):
+                        # Not the target's fault (bad request); rejected calls don't count against its limits
+                        target.refund(tokens)
+                        target.breaker.success()
+                        raise
+                    throttle = error_code(e) in THROTTLE_CODES
+                    throttled = throttled or throttle
+                    target.failed(throttle)
+                    last_error = e
+                    continue
+                response = result if isinstance(result, dict) else None
+                record_bedrock(target.model_id, target.region, time.perf_counter() - start, response)
+                target.succeeded(tokens, response and response.get("usage"))
+                return result
+
+            if attempt < self.max_attempts - 1:
+                await asyncio.sleep(self._backoff(attempt, wait))
+
+        raise ModelUnavailable(route, self._retry_after(route, tokens), throttled, last_error)
+
+    def _backoff(self, attempt, wait):
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        if wait != math.inf:
+            delay = max(delay, min(wait, self.max_backoff))
+        return delay
+
+    def _retry_after(self, route, tokens):
+        # A target is usable again once it has rate-limit room and its breaker lets a call through
+        waits = [max(t.wait_time(tokens), t.breaker.remaining()) for t in self.routes[route]]
+        return max(1, math.ceil(min(waits)))
+
+
+def router_from_env(default_routes, backend, client_factory):
+    """Build a router from ``MODEL_ROUTES`` (JSON) or ``default_routes``.
+
+    Routes map a name to a list of ``{"region", "model", "rpm", "tpm",
+    "prompt_caching"}`` entries; only ``region`` and ``model`` are required.
+    Targets that appear in several routes share their limits.
+    """
+    config = json.loads(os.getenv("MODEL_ROUTES") or "null") or default_routes
+    rpm = int(os.getenv("TARGET_RPM", 200))
+    tpm = int(os.getenv("TARGET_TPM", 400000))
+    threshold = int(os.getenv("BREAKER_THRESHOLD", 5))
+    cooldown = float(os.getenv("BREAKER_COOLDOWN", 30))
+
+    targets = {}
+    routes = {}
+    for name, entries in config.items():
+        routes[name] = []
+        for entry in entries:
+            key = (entry["region"], entry["model"])
+            if key not in targets:
+                targets[key] = Target(
+                    entry["region"],
+                    entry["model"],
+                    rpm=entry.get("rpm", rpm),
+                    tpm=entry.get("tpm", tpm),
+                    breaker=CircuitBreaker(threshold, cooldown),
+                    prompt_caching=entry.get("prompt_caching", False),
+                )
+            routes[name].append(targets[key])
+
+    return ModelRouter(
+        routes,
+        backend,
+        client_factory,
+        max_attempts=int(os.getenv("ROUTER_MAX_ATTEMPTS", 3)),
+    )
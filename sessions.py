@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from images import estimate_text_tokens
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+
+class Session:
+    """A conversation about one photo set, kept server-side between calls.
+
+    The first user turn holds the images followed by a cache point, so
+    Bedrock can reuse that prefix on every follow-up. When building a
+    request a second, moving cache point goes after the latest answer so
+    earlier turns are read from cache too. The router strips both for
+    targets without prompt caching.
+    """
+
+    def __init__(self, session_id, context, tokens):
+        self.id = session_id
+        self.context = list(context) + [CACHE_POINT]
+        self.turns = []  # (question, assistant message) pairs
+        self.tokens = tokens
+        self.size = sum(len(block["image"]["source"]["bytes"]) for block in context if "image" in block)
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def request_messages(self, question):
+        messages = []
+        for i, (asked, answer) in enumerate(self.turns):
+            content = [{"text": asked}]
+            if i == 0:
+                content = self.context + content
+            messages.append({"role": "user", "content": content})
+            messages.append(answer)
+
+        if messages:
+            last = messages[-1]
+            messages[-1] = {**last, "content": last["content"] + [CACHE_POINT]}
+
+        content = [{"text": question}]
+        if not self.turns:
+            content = self.context + content
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def record(self, question, answer):
+        self.turns.append((question, answer))
+        text = question + "".join(block.get("text", "") for block in answer["content"])
+        self.tokens += estimate_text_tokens(text)
+        self.size += len(text)
+
+
+class SessionStore:
+    """Sessions by ID, evicted least-recently-used past ``max_bytes`` or after ``idle_ttl`` seconds."""
+
+    def __init__(self, max_bytes, idle_ttl):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, context, tokens):
+        session = Session(uuid.uuid4().hex, context, tokens)
+        self._sessions[session.id] = session
+        self._evict()
+        return session
+
+    def get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_used > self.idle_ttl:
+            del self._sessions[session_id]
+            return None
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def discard(self, session):
+        self._sessions.pop(session.id, None)
+
+    def touched(self, session):
+        # Called after a turn is recorded: the session grew and may push others out
+        session.last_used = time.monotonic()
+        if session.id in self._sessions:
+            self._sessions.move_to_end(session.id)
+        self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for session_id in [s.id for s in self._sessions.values() if now - s.last_used > self.idle_ttl]:
+            del self._sessions[session_id]
+        total = sum(s.size for s in self._sessions.values())
+        while total > self.max_bytes and len(self._sessions) > 1:
+            _, session = self._sessions.popitem(last=False)
+            total -= session.size
+
+
+def sessions_from_env():
+    return SessionStore(
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", 512 * 1024 * 1024)),
+        idle_ttl=float(os.getenv("SESSION_IDLE_TTL", 1800)),
+    )
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+
+from fastapi.responses import StreamingResponse
+
+from metrics import record_usage
+
+_DONE = object()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ConverseStream:
+    """A ``converse_stream`` being drained on a pool thread, relayed to the loop as SSE.
+
+    ``cancel`` stops the pump and closes the underlying event stream, which
+    unblocks a read waiting on Bedrock and frees the backend slot right away.
+    """
+
+    def __init__(self, model_id, on_usage=None):
+        self.model_id = model_id
+        self.on_usage = on_usage
+        self.queue = asyncio.Queue()
+        self.stop = threading.Event()
+        self.future = None
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def pump(self, loop, opened, client, kwargs):
+        try:
+            stream = client.converse_stream(**kwargs)["stream"]
+        except Exception as e:
+            loop.call_soon_threadsafe(opened.set_exception, e)
+            return
+        with self._lock:
+            self._stream = stream
+            cancelled = self.stop.is_set()
+        loop.call_soon_threadsafe(opened.set_result, None)
+        try:
+            if cancelled:
+                return
+            for event in stream:
+                if self.stop.is_set():
+                    break
+                loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except Exception:
+            # Reads fail once cancel() closes the stream under us
+            if not self.stop.is_set():
+                raise
+        finally:
+            stream.close()
+
+    def cancel(self):
+        with self._lock:
+            self.stop.set()
+            stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    async def events(self):
+        stop_reason = None
+        usage = None
+        metrics = None
+        try:
+            while True:
+                event = await self.queue.get()
+                if event is _DONE:
+                    break
+                if "contentBlockDelta" in event:
+                    text = event["contentBlockDelta"]["delta"].get("text")
+                    if text:
+                        yield sse("delta", {"text": text})
+                elif "messageStop" in event:
+                    stop_reason = event["messageStop"].get("stopReason")
+                elif "metadata" in event:
+                    usage = event["metadata"].get("usage")
+                    metrics = event["metadata"].get("metrics")
+
+            if not self.future.cancelled() and self.future.exception():
+                yield sse("error", {"error": str(self.future.exception())})
+                return
+
+            record_usage(self.model_id, usage, metrics)
+            if usage and self.on_usage is not None:
+                self.on_usage(usage)
+            yield sse("done", {
+                "model": self.model_id,
+                "stopReason": stop_reason,
+                "usage": usage,
+                "metrics": metrics,
+            })
+        finally:
+            self.cancel()
+
+
+class ConverseStreamResponse(StreamingResponse):
+    """SSE response that cancels its stream however the response ends.
+
+    The generator's own cleanup only runs if it was started, so a client
+    that disconnects before the first event would otherwise leave the pump
+    reading the whole answer.
+    """
+
+    def __init__(self, stream, **kwargs):
+        super().__init__(stream.events(), media_type="text/event-stream", **kwargs)
+        self.stream = stream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.stream.cancel()
+
+
+async def open_converse_stream(backend, client, on_usage=None, **kwargs):
+    """Start ``client.converse_stream`` on ``backend`` and return a ``ConverseStream``.
+
+    The blocking event stream is drained on a pool thread and handed to the
+    loop through a queue. Saturation and errors opening the stream (such as
+    throttling) are raised here, before any bytes are sent, so the caller
+    can still fail over or answer with a 429. ``on_usage`` is called with
+    the final token usage once the stream completes.
+    """
+    loop = asyncio.get_running_loop()
+    stream = ConverseStream(kwargs.get("modelId"), on_usage)
+    opened = loop.create_future()
+    stream.future = await backend.submit(stream.pump, loop, opened, client, kwargs)
+    stream.future.add_done_callback(lambda _: stream.queue.put_nowait(_DONE))
+    try:
+        await opened
+    except asyncio.CancelledError:
+        stream.cancel()
+        raise
+    return stream
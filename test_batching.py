@@ -0,0 +1,63 @@
+from batching import batch_prompt, pack, packable, split_batch
+
+
+def test_pack_keeps_order_across_batches():
+    texts = [f"paragraph {i} " * (i % 5 + 1) for i in range(40)]
+
+    batches = pack(texts, budget=30, max_items=4)
+
+    assert len(batches) > 1
+    assert [i for batch in batches for i in batch] == list(range(40))
+
+
+def test_pack_fills_token_budget_exactly():
+    texts = ["abcd" * 10] * 6  # 10 estimated tokens each
+
+    assert pack(texts, budget=20, max_items=10) == [[0, 1], [2, 3], [4, 5]]
+    assert pack(texts, budget=19, max_items=10) == [[0], [1], [2], [3], [4], [5]]
+
+
+def test_pack_oversized_text_goes_alone():
+    texts = ["short", "x" * 400, "short"]
+
+    assert pack(texts, budget=20, max_items=10) == [[0], [1], [2]]
+
+
+def test_pack_stops_at_max_items():
+    texts = ["word"] * 7
+
+    assert pack(texts, budget=10_000, max_items=3) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert pack(texts, budget=10_000, max_items=1) == [[i] for i in range(7)]
+
+
+def test_text_with_our_tags_is_sent_alone_in_order():
+    texts = ["first", 'quoting <p id="0">html</p>', "third", "has </p> only", "fifth"]
+
+    assert not packable(texts[1]) and not packable(texts[3])
+    assert pack(texts, budget=10_000, max_items=10) == [[0], [1], [2], [3], [4]]
+
+
+def test_split_batch_round_trips_batch_prompt():
+    texts = ["one", "two\nlines", "three"]
+    prompt = batch_prompt(texts)
+    answer = prompt[prompt.index("<p id="):].replace("one", "One")
+
+    assert split_batch(answer, 3) == ["One", "two\nlines", "three"]
+
+
+def test_split_batch_missing_id_is_none():
+    answer = '<p id="0">One.</p>\n\n<p id="2">Three.</p>'
+
+    assert split_batch(answer, 3) == ["One.", None, "Three."]
+
+
+def test_split_batch_duplicate_id_is_none():
+    answer = '<p id="0">One.</p><p id="1">Two.</p><p id="1">Two again.</p><p id="2">Three.</p>'
+
+    assert split_batch(answer, 3) == ["One.", None, "Three."]
+
+
+def test_split_batch_ignores_unknown_ids():
+    answer = '<p id="0">One.</p><p id="7">Stray.</p>'
+
+    assert split_batch(answer, 2) == ["One.", None]
@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from executor import Backend
+from fakes import FakeBedrock, FakeS3
+from image_cache import ImageCache
+from images import prepare_image
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main.router, "client_factory", lambda region: FakeBedrock(0))
+    monkeypatch.setattr(main.router, "clients", {})
+    return TestClient(main.app, headers={"X-Cache-Bypass": "1"})
+
+
+def test_summary_with_more_images_than_the_image_pool_admits(client, monkeypatch):
+    image_backend = Backend("image", max_concurrency=1, max_queue=2, queue_timeout=5)
+    monkeypatch.setattr(main, "image_backend", image_backend)
+    monkeypatch.setattr(main, "image_cache", ImageCache(FakeS3(0, [(2000, 1500)]), 64 * 1024 * 1024, transform=prepare_image))
+    keys = [f"uploads/{i}.jpg" for i in range(image_backend.max_concurrency + image_backend.max_queue + 5)]
+
+    response = client.post("/generate-summary", json={"image_keys": keys, "prompt": "Describe these."})
+
+    assert response.status_code == 200
+    assert main.image_cache.misses == len(keys)
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/grammar-check/batch", {"texts": "not a list"}),
+    ("/grammar-check/batch", {"texts": ["ok", 3]}),
+    ("/get-image-url/batch", {"keys": "uploads/a.jpg"}),
+    ("/get-image-url/batch", {"keys": [None]}),
+    ("/generate-upload-url/batch", {"content_types": "image/png"}),
+    ("/generate-upload-url/batch", {"content_types": [{"type": "image/png"}]}),
+    ("/generate-upload-url/batch", {"count": "3"}),
+])
+def test_batch_endpoints_require_lists_of_strings(client, path, body):
+    response = client.post(path, json=body)
+
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_grammar_batch_retries_paragraphs_missing_from_the_answer(client, monkeypatch):
+    class DropsParagraphs(FakeBedrock):
+        def converse(self, messages, **kwargs):
+            prompt = messages[0]["content"][0]["text"]
+            self.prompts.append(prompt)
+            # Batched prompts get only their first paragraph back
+            text = '<p id="0">Fixed first.</p>' if '<p id="' in prompt else f"Fixed alone: {prompt[-5:]}"
+            return {
+                "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+                "stopReason": "end_turn",
+                "usage": {"inputTokens": 10, "outputTokens": 5, "totalTokens": 15},
+            }
+
+    fake = DropsParagraphs(0)
+    fake.prompts = []
+    monkeypatch.setattr(main.router, "client_factory", lambda region: fake)
+
+    response = client.post("/grammar-check/batch", json={"texts": ["aaaaa", "bbbbb", "ccccc"]})
+
+    assert response.status_code == 200
+    assert response.json()["corrected"] == ["Fixed first.", "Fixed alone: bbbbb", "Fixed alone: ccccc"]
+    assert len(fake.prompts) == 3
@@ -0,0 +1,198 @@
+import asyncio
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from executor import Backend, Saturated
+from fakes import FakeBedrock
+from router import CircuitBreaker, ModelRouter, ModelUnavailable, Target
+from sessions import CACHE_POINT
+
+
+class FailingBedrock:
+    """Answers every call with a 500 until ``failing`` is cleared."""
+
+    def __init__(self):
+        self.failing = True
+        self.calls = 0
+        self.healthy = FakeBedrock(0)
+
+    def converse(self, **kwargs):
+        self.calls += 1
+        if self.failing:
+            raise ClientError(
+                {"Error": {"Code": "InternalServerException"}, "ResponseMetadata": {"HTTPStatusCode": 500}},
+                "Converse",
+            )
+        return self.healthy.converse(**kwargs)
+
+
+def make_router(clients, threshold=5, cooldown=30, rpm=100):
+    targets = [
+        Target(region, f"model-{region}", rpm=rpm, tpm=100000, breaker=CircuitBreaker(threshold, cooldown))
+        for region in clients
+    ]
+    backend = Backend("bedrock", max_concurrency=4, max_queue=16, queue_timeout=5)
+    router = ModelRouter(
+        {"chat": targets}, backend, lambda region: clients[region],
+        max_attempts=2, base_backoff=0.001, max_backoff=0.01,
+    )
+    return router, targets
+
+
+def converse(router):
+    return asyncio.run(router.converse("chat", 10, messages=[]))
+
+
+def test_fails_over_on_throttle():
+    primary, secondary = FakeBedrock(0, throttle_rate=1.0), FakeBedrock(0)
+    router, (first, _) = make_router({"us-east-1": primary, "us-west-2": secondary})
+
+    response = converse(router)
+
+    assert response["modelId"] == "model-us-west-2"
+    assert primary.calls == 1
+    assert secondary.calls == 1
+    assert not first.breaker.is_open
+
+
+def test_breaker_opens_then_half_opens_after_cooldown():
+    primary, secondary = FailingBedrock(), FakeBedrock(0)
+    router, (first, _) = make_router({"us-east-1": primary, "us-west-2": secondary}, threshold=2, cooldown=0.05)
+
+    converse(router)
+    converse(router)
+    assert first.breaker.is_open
+
+    # Open: the failing target is skipped without being called
+    converse(router)
+    assert primary.calls == 2
+
+    time.sleep(0.06)
+    primary.failing = False
+    response = converse(router)
+
+    assert response["modelId"] == "model-us-east-1"
+    assert primary.calls == 3
+    assert not first.breaker.is_open
+
+
+def test_rate_scale_halves_on_throttle_and_recovers_on_success():
+    primary, secondary = FakeBedrock(0, throttle_rate=1.0), FakeBedrock(0)
+    router, (first, _) = make_router({"us-east-1": primary, "us-west-2": secondary})
+
+    converse(router)
+    assert first.requests.scale == first.tokens.scale == 0.5
+    converse(router)
+    assert first.requests.scale == 0.25
+
+    primary.throttle_rate = 0.0
+    converse(router)
+    assert first.requests.scale == pytest.approx(0.3)
+    assert first.tokens.scale == pytest.approx(0.3)
+
+
+def test_all_targets_throttled_is_429():
+    router, _ = make_router({"us-east-1": FakeBedrock(0, throttle_rate=1.0), "us-west-2": FakeBedrock(0, throttle_rate=1.0)})
+
+    with pytest.raises(ModelUnavailable) as raised:
+        converse(router)
+
+    assert raised.value.status_code == 429
+
+
+def test_all_targets_rate_limited_is_429():
+    router, _ = make_router({"us-east-1": FakeBedrock(0)}, rpm=1)
+    converse(router)
+
+    with pytest.raises(ModelUnavailable) as raised:
+        converse(router)
+
+    assert raised.value.status_code == 429
+    assert raised.value.retry_after >= 1
+
+
+def test_all_targets_failing_is_503():
+    # Breakers open on the first pass, so the second pass skips every target
+    router, targets = make_router({"us-east-1": FailingBedrock(), "us-west-2": FailingBedrock()}, threshold=1)
+
+    with pytest.raises(ModelUnavailable) as raised:
+        converse(router)
+
+    assert all(target.breaker.is_open for target in targets)
+    assert raised.value.status_code == 503
+
+
+def test_breakers_already_open_is_503():
+    router, _ = make_router({"us-east-1": FailingBedrock(), "us-west-2": FailingBedrock()}, threshold=1)
+    with pytest.raises(ModelUnavailable):
+        converse(router)
+
+    # Nothing is even tried now, but the targets are down, not rate limited
+    with pytest.raises(ModelUnavailable) as raised:
+        converse(router)
+
+    assert raised.value.status_code == 503
+
+
+def test_cache_points_only_reach_prompt_caching_targets():
+    class Recording(FakeBedrock):
+        def converse(self, **kwargs):
+            self.request = kwargs
+            return super().converse(**kwargs)
+
+    client = Recording(0)
+    router, (target,) = make_router({"us-east-1": client})
+    messages = [{"role": "user", "content": [{"text": "photos"}, CACHE_POINT, {"text": "question"}]}]
+
+    asyncio.run(router.converse("chat", 10, messages=messages))
+    assert client.request["messages"][0]["content"] == [{"text": "photos"}, {"text": "question"}]
+
+    target.prompt_caching = True
+    asyncio.run(router.converse("chat", 10, messages=messages))
+    assert client.request["messages"] == messages
+
+
+def test_retry_after_waits_for_breaker_cooldown():
+    router, _ = make_router({"us-east-1": FailingBedrock(), "us-west-2": FailingBedrock()}, threshold=1, cooldown=30)
+    with pytest.raises(ModelUnavailable):
+        converse(router)
+
+    with pytest.raises(ModelUnavailable) as raised:
+        converse(router)
+
+    assert raised.value.status_code == 503
+    assert 29 <= raised.value.retry_after <= 30
+
+
+def test_local_saturation_refunds_limits_and_keeps_breaker_open():
+    router, (target,) = make_router({"us-east-1": FakeBedrock(0)}, threshold=1, cooldown=30)
+    target.breaker.failure()
+    target.breaker.opened_at -= 31  # cooldown over: the next call is the half-open trial
+
+    async def saturated(target):
+        raise Saturated("bedrock", 1)
+
+    with pytest.raises(Saturated):
+        asyncio.run(router.call("chat", 500, saturated))
+
+    assert target.requests.tokens == pytest.approx(target.requests.capacity)
+    assert target.tokens.tokens == pytest.approx(target.tokens.capacity)
+    assert target.breaker.is_open
+    # Bedrock never answered, so the next call still gets to be the trial
+    assert target.breaker.allow()
+
+
+def test_rejected_request_refunds_limits():
+    class Invalid(FakeBedrock):
+        def converse(self, **kwargs):
+            raise ClientError({"Error": {"Code": "ValidationException"}}, "Converse")
+
+    router, (target,) = make_router({"us-east-1": Invalid(0)})
+
+    with pytest.raises(ClientError):
+        converse(router)
+
+    assert target.requests.tokens == pytest.approx(target.requests.capacity)
+    assert target.tokens.tokens == pytest.approx(target.tokens.capacity)